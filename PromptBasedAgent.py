@@ -1,5 +1,14 @@
 import os
+import re
+import json
+import shutil
+import hashlib
 import datetime
+import functools
+import math
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from langchain_core.messages import AnyMessage
 from langchain_core.runnables import RunnableConfig
@@ -15,17 +24,55 @@ from langchain_community.document_loaders import (
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 # ── Local embeddings + vector store ──────────────────────────────────────────
+import faiss
+import numpy as np
 from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 
+# ── Streamlit caches (no-op outside Streamlit) ─────────────────────────────
+try:
+    import streamlit as st
+    _cache_resource = st.cache_resource
+    _cache_data     = st.cache_data
+except ImportError:
+    def _cache_resource(**kwargs):
+        return functools.cache
+
+    def _cache_data(ttl=None, **kwargs):
+        def decorator(func):
+            entries = {}
+
+            @functools.wraps(func)
+            def wrapper(*args):
+                hit = entries.get(args)
+                if hit is not None and (ttl is None or time.monotonic() - hit[0] < ttl):
+                    return hit[1]
+                value = func(*args)
+                entries[args] = (time.monotonic(), value)
+                return value
+            return wrapper
+        return decorator
+
 # ── Google Drive ──────────────────────────────────────────────────────────────
 import gdrive_utils
 
 PROMPT_NAME  = "agent.prompt"
 PROMPT_PATH  = os.path.join(os.path.dirname(__file__), "prompts", PROMPT_NAME)
 RAG_DIR      = os.path.join(os.path.dirname(__file__), "rag")
+RAG_CACHE_DIR = os.path.join(RAG_DIR, ".cache")
 OPENAI_MODEL = "gpt-4.1-mini"
 EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_ENCODE_KWARGS = {"batch_size": 64, "normalize_embeddings": True}
+# "onnx" runs the int8-quantized ONNX export shipped in the model repo through
+# onnxruntime; set EMBEDDING_BACKEND=torch to use the PyTorch weights instead.
+EMBEDDING_BACKEND   = os.environ.get("EMBEDDING_BACKEND", "onnx")
+EMBEDDING_ONNX_FILE = os.environ.get("EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+
+# Corpora at or above this many chunks get an IVF index (8-bit scalar-quantized
+# vectors) instead of a flat scan
+RAG_IVF_MIN_CHUNKS = int(os.environ.get("RAG_IVF_MIN_CHUNKS", 10_000))
+RAG_IVF_NPROBE     = int(os.environ.get("RAG_IVF_NPROBE", 8))
 
 # Folder ID comes from env / Streamlit secrets (set GDRIVE_FOLDER_ID)
 GDRIVE_FOLDER_ID = os.environ.get("GDRIVE_FOLDER_ID", "")
@@ -37,50 +84,172 @@ _LOADERS = {
     ".docx": Docx2txtLoader,
 }
 
-def _load_documents():
-    docs = []
-    rag_path = Path(RAG_DIR)
-    for path in rag_path.iterdir():
-        loader_cls = _LOADERS.get(path.suffix.lower())
-        if loader_cls is None:
-            continue
+# Worker count for parallel document loading (override with RAG_LOAD_WORKERS)
+RAG_LOAD_WORKERS = int(
+    os.environ.get("RAG_LOAD_WORKERS", min(os.cpu_count() or 1, 4))
+)
+
+RAG_CHUNK_SIZE    = 500
+RAG_CHUNK_OVERLAP = 50
+_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=RAG_CHUNK_SIZE, chunk_overlap=RAG_CHUNK_OVERLAP
+)
+
+# Collapse runs of inline whitespace and blank lines, keeping paragraph breaks
+# for the splitter's "\n\n" separator.
+_INLINE_WS_RE   = re.compile(r"[ \t\f\v\r]+")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n\s*")
+
+def _normalize_whitespace(text: str) -> str:
+    return _BLANK_LINES_RE.sub("\n\n", _INLINE_WS_RE.sub(" ", text)).strip()
+
+def _scan_rag_dir() -> list[os.DirEntry]:
+    """Return the loadable files in rag/ from a single directory scan."""
+    with os.scandir(RAG_DIR) as it:
+        return [
+            entry for entry in it
+            if entry.is_file()
+            and os.path.splitext(entry.name)[1].lower() in _LOADERS
+        ]
+
+def _load_one(entry: os.DirEntry) -> list:
+    loader_cls = _LOADERS[os.path.splitext(entry.name)[1].lower()]
+    try:
+        loader = loader_cls(entry.path)
+        loaded = loader.load()
+        for doc in loaded:
+            doc.page_content = _normalize_whitespace(doc.page_content)
+            doc.metadata.setdefault("source", entry.name)
+        print(f"[RAG] Loaded: {entry.name} ({len(loaded)} chunk(s))")
+        return loaded
+    except Exception as e:
+        print(f"[RAG] Warning — could not load {entry.name}: {e}")
+        return []
+
+def _load_documents(entries: list[os.DirEntry]):
+    with ThreadPoolExecutor(max_workers=max(RAG_LOAD_WORKERS, 1)) as pool:
+        results = list(pool.map(_load_one, entries))
+    return [doc for loaded in results for doc in loaded]
+
+def _index_cache_key(entries: list[os.DirEntry]) -> str:
+    """Hash the (name, mtime, size) of every loadable file in rag/."""
+    files = []
+    for entry in entries:
+        info = entry.stat()
+        files.append((entry.name, info.st_mtime_ns, info.st_size))
+    # Index settings are part of the key so changing them forces a rebuild.
+    settings = [
+        EMBEDDING_MODEL, EMBEDDING_BACKEND, EMBEDDING_ONNX_FILE, EMBEDDING_ENCODE_KWARGS,
+        RAG_CHUNK_SIZE, RAG_CHUNK_OVERLAP, "ws-normalized",
+        RAG_IVF_MIN_CHUNKS, "IVF,SQ8",
+    ]
+    payload = json.dumps([settings, sorted(files)]).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+def _prune_index_cache(keep: str) -> None:
+    for entry in Path(RAG_CACHE_DIR).iterdir():
+        if entry.name != keep and entry.is_dir():
+            shutil.rmtree(entry, ignore_errors=True)
+
+@_cache_resource(show_spinner=False)
+def get_embeddings():
+    """Load the sentence-transformer once per process."""
+    model_kwargs = {"backend": EMBEDDING_BACKEND}
+    if EMBEDDING_BACKEND == "onnx":
+        model_kwargs["model_kwargs"] = {"file_name": EMBEDDING_ONNX_FILE}
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL,
+        model_kwargs=model_kwargs,
+        encode_kwargs=EMBEDDING_ENCODE_KWARGS,
+    )
+
+def _set_nprobe(index: faiss.Index) -> None:
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = RAG_IVF_NPROBE
+
+def _make_faiss_index(vectors: np.ndarray) -> faiss.Index:
+    """Exact flat index for small corpora, IVF + SQ8 for large ones."""
+    n, d = vectors.shape
+    # FAISS wants ~39 training points per list; too few points for 2 lists
+    # means IVF would not help, so stay flat.
+    nlist = min(int(4 * math.sqrt(n)), n // 39)
+    if n < RAG_IVF_MIN_CHUNKS or nlist < 2:
+        index = faiss.IndexFlatL2(d)
+    else:
+        quantizer = faiss.IndexFlatL2(d)
+        index = faiss.IndexIVFScalarQuantizer(
+            quantizer, d, nlist, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2
+        )
+        index.train(vectors)
+        _set_nprobe(index)
+    index.add(vectors)
+    return index
+
+def _build_index():
+    entries   = _scan_rag_dir()
+    key       = _index_cache_key(entries)
+    cache_dir = os.path.join(RAG_CACHE_DIR, key)
+    if os.path.isdir(cache_dir):
+        embeddings = get_embeddings()
         try:
-            loader = loader_cls(str(path))
-            loaded = loader.load()
-            for doc in loaded:
-                doc.metadata.setdefault("source", path.name)
-            docs.extend(loaded)
-            print(f"[RAG] Loaded: {path.name} ({len(loaded)} chunk(s))")
+            db = FAISS.load_local(
+                cache_dir, embeddings, allow_dangerous_deserialization=True
+            )
+            _set_nprobe(db.index)
+            print(f"[RAG] Index loaded from cache ({key[:12]}).")
+            return db.as_retriever(search_kwargs={"k": 4})
         except Exception as e:
-            print(f"[RAG] Warning — could not load {path.name}: {e}")
-    return docs
+            print(f"[RAG] Warning — could not load cached index, rebuilding: {e}")
 
-def _build_index():
-    docs = _load_documents()
+    docs = _load_documents(entries)
     if not docs:
         print("[RAG] No documents found in rag/ — retrieval tool will be disabled.")
         return None
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    chunks   = splitter.split_documents(docs)
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-    db = FAISS.from_documents(chunks, embeddings)
+    chunks   = _SPLITTER.split_documents(docs)
+    embeddings = get_embeddings()
+    vectors = np.asarray(
+        embeddings.embed_documents([c.page_content for c in chunks]),
+        dtype="float32",
+    )
+    ids = [str(uuid.uuid4()) for _ in chunks]
+    db = FAISS(
+        embedding_function=embeddings,
+        index=_make_faiss_index(vectors),
+        docstore=InMemoryDocstore(dict(zip(ids, chunks))),
+        index_to_docstore_id=dict(enumerate(ids)),
+    )
     print(f"[RAG] Index built: {len(chunks)} chunks from {len(docs)} document(s).")
+    try:
+        db.save_local(cache_dir)
+        _prune_index_cache(keep=key)
+    except Exception as e:
+        print(f"[RAG] Warning — could not cache index: {e}")
     return db.as_retriever(search_kwargs={"k": 4})
 
-_retriever = _build_index()
+@_cache_resource(show_spinner=False)
+def get_retriever():
+    """Build (or load) the RAG retriever once per process."""
+    try:
+        return _build_index()
+    except Exception as e:
+        print(f"[RAG] Warning — could not build index, retrieval tool will be disabled: {e}")
+        return None
 
 # ── Existing tools ────────────────────────────────────────────────────────────
 def get_current_date() -> str:
     """Get today's date in ISO format."""
     return datetime.date.today().isoformat()
 
-def search_documents(query: str) -> str:
-    """Search the internal knowledge base for information relevant to the query.
-    Returns the most relevant passages found in the loaded documents."""
-    if _retriever is None:
-        return "No documents are available in the knowledge base."
-    try:
-        results = _retriever.invoke(query)
+@_cache_resource(show_spinner=False)
+def _get_searcher():
+    """Return an LRU-memoized search over the retriever, or None if disabled."""
+    retriever = get_retriever()
+    if retriever is None:
+        return None
+
+    @functools.lru_cache(maxsize=256)
+    def search(query: str) -> str:
+        results = retriever.invoke(query)
         if not results:
             return "No relevant passages found."
         parts = []
@@ -88,10 +257,29 @@ def search_documents(query: str) -> str:
             source = doc.metadata.get("source", "unknown")
             parts.append(f"[{i}] (source: {source})\n{doc.page_content.strip()}")
         return "\n\n".join(parts)
+    return search
+
+def search_documents(query: str) -> str:
+    """Search the internal knowledge base for information relevant to the query.
+    Returns the most relevant passages found in the loaded documents."""
+    try:
+        search = _get_searcher()
+        if search is None:
+            return "No documents are available in the knowledge base."
+        return search(query.strip().lower())
     except Exception as e:
         return f"Error during document search: {e}"
 
 # ── Google Drive tools ────────────────────────────────────────────────────────
+@_cache_data(ttl=300, show_spinner=False)
+def _list_recipe_files(folder_id: str) -> list[dict]:
+    """List Drive images with a precomputed lowercase name for searching.
+    Cached for 5 minutes, like the image bytes in app.py."""
+    files = gdrive_utils.list_image_files(folder_id)
+    for f in files:
+        f.setdefault("_name_lower", f["name"].lower())
+    return files
+
 def list_drive_recipes(search: str = "") -> str:
     """List recipe image files available in the Google Drive recipe folder.
 
@@ -102,7 +290,7 @@ def list_drive_recipes(search: str = "") -> str:
     if not GDRIVE_FOLDER_ID:
         return "Google Drive folder is not configured (GDRIVE_FOLDER_ID missing)."
     try:
-        files = gdrive_utils.list_image_files(GDRIVE_FOLDER_ID)
+        files = _list_recipe_files(GDRIVE_FOLDER_ID)
     except Exception as e:
         return f"Error accessing Google Drive: {e}"
 
@@ -111,7 +299,7 @@ def list_drive_recipes(search: str = "") -> str:
 
     if search:
         term = search.lower()
-        files = [f for f in files if term in f["name"].lower()]
+        files = [f for f in files if term in f["_name_lower"]]
         if not files:
             return f"No recipe images matched '{search}'."
 
@@ -133,14 +321,13 @@ def get_recipe_image(file_id: str) -> str:
 
 
 # ── Prompt ────────────────────────────────────────────────────────────────────
+@functools.cache
 def _load_system_prompt() -> str:
     with open(PROMPT_PATH, "r", encoding="utf-8") as f:
         return f.read().strip()
 
-base_system_prompt = _load_system_prompt()
-
 def prompt(state: AgentState, config: RunnableConfig) -> list[AnyMessage]:
-    system_msg = base_system_prompt
+    system_msg = _load_system_prompt()
     return [{"role": "system", "content": system_msg}] + state["messages"]
 
 # ── Graph ─────────────────────────────────────────────────────────────────────
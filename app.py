@@ -1,8 +1,14 @@
 import os
 import re
 import uuid
+import io
 import base64
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
+from PIL import Image, ImageOps
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # ── 0. Page config ────────────────────────────────────────────────────────────
 st.set_page_config(page_title="Prompt-based Agent", page_icon="🎯")
@@ -32,10 +38,38 @@ import gdrive_utils                         # noqa: E402
 def make_thread_id(seed: str) -> str:
     return str(uuid.uuid5(uuid.NAMESPACE_DNS, seed))
 
-def file_to_base64(uploaded_file) -> tuple[str, str]:
+# Uploads are downscaled to this longest side before being sent to the model.
+LC_IMAGE_MAX_SIDE = 1536
+
+def shrink_for_model(raw: bytes, mime_type: str) -> tuple[bytes, str]:
+    """Downscale large photos to JPEG so each request carries fewer bytes."""
+    if mime_type == "image/gif":
+        return raw, mime_type
+    try:
+        img = Image.open(io.BytesIO(raw))
+        if max(img.size) <= LC_IMAGE_MAX_SIDE:
+            return raw, mime_type
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+            # JPEG has no alpha; flatten onto white so transparent pixels don't go black
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, "white")
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            img = img.convert("RGB")
+        img.thumbnail((LC_IMAGE_MAX_SIDE, LC_IMAGE_MAX_SIDE))
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=85)
+        return buf.getvalue(), "image/jpeg"
+    except Exception:
+        return raw, mime_type
+
+def file_to_base64(uploaded_file) -> tuple[str, str, bytes]:
     mime_type = uploaded_file.type or "image/jpeg"
-    b64 = base64.b64encode(uploaded_file.read()).decode("utf-8")
-    return b64, mime_type
+    raw = uploaded_file.getvalue()
+    payload, mime_type = shrink_for_model(raw, mime_type)
+    b64 = base64.b64encode(payload).decode("utf-8")
+    return b64, mime_type, raw
 
 def build_lc_content(text: str, image_b64: str | None, mime_type: str | None) -> str | list:
     if image_b64:
@@ -45,40 +79,108 @@ def build_lc_content(text: str, image_b64: str | None, mime_type: str | None) ->
         ]
     return text
 
-def run_graph(messages: list, thread_id: str) -> str:
-    config = {"configurable": {"thread_id": thread_id}}
-    result = graph.invoke({"messages": messages}, config=config)
-    last = result["messages"][-1]
-    if hasattr(last, "content"):
-        return last.content
-    return str(last.get("content", last))
+# Images stay inline for this many recent user turns; older ones become a placeholder.
+LC_IMAGE_KEEP_TURNS = 2
+
+def drop_old_images(messages: list, keep_turns: int = LC_IMAGE_KEEP_TURNS) -> None:
+    """Swap the image out of the user message that just left the keep window."""
+    human_idx = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+    if len(human_idx) <= keep_turns:
+        return
+    i = human_idx[-keep_turns - 1]
+    content = messages[i].content
+    if isinstance(content, list):
+        text = " ".join(b["text"] for b in content if b.get("type") == "text")
+        messages[i] = HumanMessage(content=f"{text} [IMAGE_SEEN]".strip())
 
-def render_image(b64: str, width: int = 280) -> None:
-    st.image(base64.b64decode(b64), width=width)
+def render_image(raw: bytes, width: int = 280) -> None:
+    st.image(raw, width=width)
 
 # ── 3a. Recipe-image renderer ─────────────────────────────────────────────────
-_IMAGE_TAG = re.compile(r"\[RECIPE_IMAGE:([^\]]+)\]")
+_TAG_PREFIX = "[RECIPE_IMAGE:"
+_IMAGE_TAG  = re.compile(re.escape(_TAG_PREFIX) + r"([^\]]+)\]")
 
 @st.cache_data(ttl=300, show_spinner=False)
 def _fetch_drive_image(file_id: str) -> bytes:
     """Download a Drive image and cache it for 5 minutes."""
     return gdrive_utils.download_bytes(file_id)
 
+def _fetch_drive_images(file_ids: list[str]) -> dict[str, bytes | Exception]:
+    """Download several Drive images concurrently; failures are returned, not raised."""
+    def fetch(file_id: str) -> bytes | Exception:
+        try:
+            return _fetch_drive_image(file_id)
+        except Exception as e:
+            return e
+
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(
+        max_workers=min(len(file_ids), 8),
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx),
+    ) as pool:
+        return dict(zip(file_ids, pool.map(fetch, file_ids)))
+
+def _render_drive_image(file_id: str, img: bytes | Exception | None = None) -> None:
+    try:
+        if img is None:
+            img = _fetch_drive_image(file_id)
+        if isinstance(img, Exception):
+            raise img
+        st.image(img, use_container_width=True)
+    except Exception as e:
+        st.warning(f"⚠️ Could not load recipe image ({file_id}): {e}")
+
 def render_response(response: str) -> None:
     """Render an assistant response, replacing [RECIPE_IMAGE:id] tags with images."""
-    parts = _IMAGE_TAG.split(response)
-    # split() on a group alternates:  text, file_id, text, file_id, …
-    for i, part in enumerate(parts):
-        if i % 2 == 0:          # plain text segment
-            if part.strip():
-                st.markdown(part.strip())
-        else:                   # captured file_id
-            file_id = part.strip()
-            try:
-                img_bytes = _fetch_drive_image(file_id)
-                st.image(img_bytes, use_container_width=True)
-            except Exception as e:
-                st.warning(f"⚠️ Could not load recipe image ({file_id}): {e}")
+    if _IMAGE_TAG.search(response) is None:
+        st.markdown(response)
+        return
+    file_ids = list(dict.fromkeys(fid.strip() for fid in _IMAGE_TAG.findall(response)))
+    images = _fetch_drive_images(file_ids) if len(file_ids) > 1 else {}
+    pos = 0
+    for match in _IMAGE_TAG.finditer(response):
+        text = response[pos:match.start()].strip()
+        if text:
+            st.markdown(text)
+        file_id = match.group(1).strip()
+        _render_drive_image(file_id, images.get(file_id))
+        pos = match.end()
+    text = response[pos:].strip()
+    if text:
+        st.markdown(text)
+
+def _split_partial_tag(buf: str) -> tuple[str, str]:
+    """Drop complete image tags from *buf* and hold back a trailing partial one."""
+    buf = _IMAGE_TAG.sub("", buf)
+    start = buf.rfind("[")
+    if start != -1:
+        tail = buf[start:]
+        if "]" not in tail and (_TAG_PREFIX.startswith(tail) or tail.startswith(_TAG_PREFIX)):
+            return buf[:start], tail
+    return buf, ""
+
+def run_graph_stream(messages: list, thread_id: str, result: dict):
+    """Yield the agent's text tokens as they arrive, with image tags withheld.
+
+    The full text of the final assistant message (tags included) is stored
+    in result["response"] once the stream is exhausted.
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    msg_id, parts, pending = None, [], ""
+    for chunk, meta in graph.stream(
+        {"messages": messages}, config=config, stream_mode="messages"
+    ):
+        if meta.get("langgraph_node") != "agent" or not isinstance(chunk.content, str):
+            continue
+        if chunk.id != msg_id:
+            msg_id, parts = chunk.id, []
+        parts.append(chunk.content)
+        visible, pending = _split_partial_tag(pending + chunk.content)
+        if visible:
+            yield visible
+    result["response"] = "".join(parts)
+    if pending:
+        yield pending
 
 # ── 4. Session state ──────────────────────────────────────────────────────────
 if "session_seed" not in st.session_state:
@@ -89,8 +191,14 @@ if "pending_b64" not in st.session_state:
     st.session_state.pending_b64 = None
 if "pending_mime" not in st.session_state:
     st.session_state.pending_mime = None
+if "pending_raw" not in st.session_state:
+    st.session_state.pending_raw = None
+if "attached_file_id" not in st.session_state:
+    st.session_state.attached_file_id = None
 if "show_camera" not in st.session_state:
     st.session_state.show_camera = False
+if "lc_messages" not in st.session_state:
+    st.session_state.lc_messages = []
 
 thread_id = make_thread_id(st.session_state.session_seed)
 
@@ -99,8 +207,10 @@ with st.sidebar:
     st.caption(f"Thread ID: `{thread_id}`")
     if st.button("🗑️ Clear conversation"):
         st.session_state.chat_history = []
+        st.session_state.lc_messages = []
         st.session_state.pending_b64 = None
         st.session_state.pending_mime = None
+        st.session_state.pending_raw = None
         st.session_state.show_camera = False
         st.rerun()
     st.divider()
@@ -111,10 +221,13 @@ with st.sidebar:
         type=["png", "jpg", "jpeg", "gif", "webp"],
         key="uploader",
     )
-    if uploaded:
-        b64, mime = file_to_base64(uploaded)
+    # Reruns keep the same upload in the widget; only process a new file once.
+    if uploaded and uploaded.file_id != st.session_state.attached_file_id:
+        st.session_state.attached_file_id = uploaded.file_id
+        b64, mime, raw = file_to_base64(uploaded)
         st.session_state.pending_b64 = b64
         st.session_state.pending_mime = mime
+        st.session_state.pending_raw = raw
 
     toggle_label = "📷 Close camera" if st.session_state.show_camera else "📷 Take a photo"
     if st.button(toggle_label, use_container_width=True):
@@ -123,20 +236,23 @@ with st.sidebar:
 
     if st.session_state.show_camera:
         camera_snap = st.camera_input("Take a photo", label_visibility="collapsed")
-        if camera_snap:
-            b64, mime = file_to_base64(camera_snap)
+        if camera_snap and camera_snap.file_id != st.session_state.attached_file_id:
+            st.session_state.attached_file_id = camera_snap.file_id
+            b64, mime, raw = file_to_base64(camera_snap)
             st.session_state.pending_b64 = b64
             st.session_state.pending_mime = mime
+            st.session_state.pending_raw = raw
             st.session_state.show_camera = False
             st.rerun()
 
     if st.session_state.pending_b64:
         st.divider()
         st.caption("📌 Attached — will send with next message")
-        render_image(st.session_state.pending_b64, width=220)
+        render_image(st.session_state.pending_raw, width=220)
         if st.button("✕ Remove image", use_container_width=True):
             st.session_state.pending_b64 = None
             st.session_state.pending_mime = None
+            st.session_state.pending_raw = None
             st.rerun()
 
 # ── 6. Title ──────────────────────────────────────────────────────────────────
@@ -145,8 +261,8 @@ st.title("Prompt Based Agent")
 # ── 7. Chat history ───────────────────────────────────────────────────────────
 for msg in st.session_state.chat_history:
     with st.chat_message(msg["role"]):
-        if msg["role"] == "user" and msg.get("image_b64"):
-            render_image(msg["image_b64"])
+        if msg["role"] == "user" and msg.get("image_raw"):
+            render_image(msg["image_raw"])
         if msg.get("content"):
             if msg["role"] == "assistant":
                 render_response(msg["content"])   # ← handles [RECIPE_IMAGE:…]
@@ -159,37 +275,46 @@ if user_input or (st.session_state.pending_b64 and user_input is not None):
     text = user_input or ""
     image_b64  = st.session_state.pending_b64
     image_mime = st.session_state.pending_mime
+    image_raw  = st.session_state.pending_raw
 
     with st.chat_message("user"):
-        if image_b64:
-            render_image(image_b64)
+        if image_raw:
+            render_image(image_raw)
         if text:
             st.markdown(text)
 
     st.session_state.chat_history.append({
         "role": "user",
         "content": text,
-        "image_b64": image_b64,
-        "image_mime": image_mime,
+        "image_raw": image_raw,
     })
 
     st.session_state.pending_b64  = None
     st.session_state.pending_mime = None
+    st.session_state.pending_raw  = None
 
-    lc_messages = []
-    for m in st.session_state.chat_history:
-        if m["role"] == "user":
-            content = build_lc_content(m["content"], m.get("image_b64"), m.get("image_mime"))
-            lc_messages.append(HumanMessage(content=content))
-        else:
-            lc_messages.append(AIMessage(content=m["content"]))
+    lc_messages = st.session_state.lc_messages
+    lc_messages.append(HumanMessage(content=build_lc_content(text, image_b64, image_mime)))
+    drop_old_images(lc_messages)
 
     with st.chat_message("assistant"):
-        with st.spinner("Thinking…"):
-            try:
-                response = run_graph(lc_messages, thread_id)
-            except Exception as exc:
-                response = f"⚠️ Error: {exc}"
-        render_response(response)   # ← handles [RECIPE_IMAGE:…]
+        placeholder = st.empty()
+        result = {"response": ""}
+        try:
+            stream = run_graph_stream(lc_messages, thread_id, result)
+            # Tool steps and the first index build emit no text; spin until they do
+            with placeholder.container():
+                with st.spinner("Thinking…"):
+                    first = next(stream, None)
+            if first is not None:
+                with placeholder.container():
+                    st.write_stream(itertools.chain([first], stream))
+            response = result["response"]
+        except Exception as exc:
+            response = f"⚠️ Error: {exc}"
+        # Re-render the final message so [RECIPE_IMAGE:…] tags become images
+        with placeholder.container():
+            render_response(response)
 
     st.session_state.chat_history.append({"role": "assistant", "content": response})
+    lc_messages.append(AIMessage(content=response))
@@ -1,30 +1,67 @@
 """Google Drive helpers — list and download recipe files."""
 
+import functools
 import io
 import json
 import os
+import re
+import threading
+from pathlib import Path
 
+import google_auth_httplib2
+import httplib2
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
+from googleapiclient.http import HttpRequest, MediaIoBaseDownload
 
 SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
+CACHE_DIR = Path(__file__).parent / ".cache" / "drive"
 
+# Drive file IDs are URL-safe base64; anything else is never used as a path.
+_FILE_ID = re.compile(r"^[A-Za-z0-9_-]+$")
 
-def _get_service():
-    """Build a Drive v3 service from env-var credentials."""
+
+_service = None
+_service_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_credentials():
+    """Parse the service-account credentials from env once per process."""
     sa_json = os.environ.get("GOOGLE_SERVICE_ACCOUNT_JSON")
     if sa_json:
         info = json.loads(sa_json)
-        creds = service_account.Credentials.from_service_account_info(
+        return service_account.Credentials.from_service_account_info(
             info, scopes=SCOPES
         )
-    else:
-        path = os.environ.get("GOOGLE_SERVICE_ACCOUNT_FILE", "service_account.json")
-        creds = service_account.Credentials.from_service_account_file(
-            path, scopes=SCOPES
-        )
-    return build("drive", "v3", credentials=creds, cache_discovery=False)
+    path = os.environ.get("GOOGLE_SERVICE_ACCOUNT_FILE", "service_account.json")
+    return service_account.Credentials.from_service_account_file(
+        path, scopes=SCOPES
+    )
+
+
+def _authorized_http() -> google_auth_httplib2.AuthorizedHttp:
+    return google_auth_httplib2.AuthorizedHttp(_get_credentials(), http=httplib2.Http())
+
+
+def _build_request(http, *args, **kwargs) -> HttpRequest:
+    # httplib2 is not thread-safe, so every request gets its own transport.
+    return HttpRequest(_authorized_http(), *args, **kwargs)
+
+
+def _get_service():
+    """Return the process-wide Drive v3 service, building it on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = build(
+                    "drive", "v3",
+                    http=_authorized_http(),
+                    requestBuilder=_build_request,
+                    cache_discovery=False,
+                )
+    return _service
 
 
 def list_image_files(folder_id: str) -> list[dict]:
@@ -35,16 +72,29 @@ def list_image_files(folder_id: str) -> list[dict]:
         f"and trashed = false "
         f"and mimeType contains 'image/'"
     )
-    res = (
-        svc.files()
-        .list(q=q, fields="files(id, name, mimeType)", pageSize=200)
-        .execute()
+    files = []
+    request = svc.files().list(
+        q=q,
+        fields="nextPageToken, files(id, name, mimeType)",
+        orderBy="name",
+        pageSize=1000,
     )
-    return res.get("files", [])
+    while request is not None:
+        res = request.execute()
+        files.extend(res.get("files", []))
+        request = svc.files().list_next(request, res)
+    return files
 
 
 def download_bytes(file_id: str) -> bytes:
-    """Download a Drive file and return its raw bytes."""
+    """Download a Drive file and return its raw bytes.
+
+    Downloads are cached on disk under CACHE_DIR, keyed by file ID.
+    """
+    cache_path = CACHE_DIR / file_id if _FILE_ID.match(file_id) else None
+    if cache_path is not None and cache_path.is_file():
+        return cache_path.read_bytes()
+
     svc = _get_service()
     request = svc.files().get_media(fileId=file_id)
     buf = io.BytesIO()
@@ -52,4 +102,16 @@ def download_bytes(file_id: str) -> bytes:
     done = False
     while not done:
         _, done = downloader.next_chunk()
-    return buf.getvalue()
+    data = buf.getvalue()
+
+    if cache_path is not None:
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(
+                f"{file_id}.{os.getpid()}.{threading.get_ident()}.tmp"
+            )
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+    return data